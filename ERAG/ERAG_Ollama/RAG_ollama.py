@@ -134,6 +134,57 @@ def validate_morphology_code(extracted_morphology, retrieved_morphology_codes):
     return call_llama_subprocess(validation_prompt, final_morphology_selection_instructions)
     
     
+#  Run the RAG steps on one report
+def code_report(report):
+    """Code one report. Returns None if a step failed."""
+    #  Step 1: Summarization
+    print("\nProcessing Summarization...")
+    summary = call_llama_subprocess(report, summarization_instructions)
+    if "Error" in summary:
+        print(f"Summarization failed: {summary}")
+        return None
+    print("\nSummary:")
+    print(summary)
+
+    #  Step 2: Extract Morphology from Summary
+    print("\nExtracting Morphology...")
+    morphology_text = call_llama_subprocess(summary, morphology_extraction_instructions)
+    if "Error" in morphology_text:
+        print(f"Morphology extraction failed: {morphology_text}")
+        return None
+    print("\nExtracted Morphology:")
+    print(morphology_text)
+
+    #  Step 3: Extract Topography from Summary
+    print("\nExtracting Topography...")
+    topography_text = call_llama_subprocess(summary, topography_extraction_instructions)
+    if "Error" in topography_text:
+        print(f"Topography extraction failed: {topography_text}")
+        return None
+    print("\nExtracted Topography:")
+    print(topography_text)
+
+    #  Step 4: Retrieve Topography Code using RAG
+    print("\nFinding Topography Code using RAG...")
+    topography_result = rag_query(topography_text, topography_vectorstore)
+    print("\nTopography Code retrieved:")
+    print(topography_result)
+
+    #  Step 5: Retrieve Morphology Code using RAG
+    print("\nFinding Morphology Code using RAG...")
+    morphology_result = rag_query(morphology_text, morphology_vectorstore)
+    print("\nMorphology Code Retrieved:")
+    print(morphology_result)
+
+    #  Step 6: Finalize the Best Topography Code
+    final_topography_code = validate_topography_code(topography_text, topography_result)
+    print("\nFinal Topography Code:", final_topography_code)
+
+    #  Step 7: Finalize the Best Morphology Code
+    final_morphology_code = validate_morphology_code(morphology_text, morphology_result)
+    print("\nFinal Morphology Code:", final_morphology_code)
+    return {"Summary": summary, "Topography": final_topography_code, "Morphology": final_morphology_code}
+
 #  Main processing function
 def main():
     while True:
@@ -144,52 +195,7 @@ def main():
             print("Exiting the program.")
             break
 
-        #  Step 1: Summarization
-        print("\nProcessing Summarization...")
-        summary = call_llama_subprocess(user_input, summarization_instructions)
-        if "Error" in summary:
-            print(f"Summarization failed: {summary}")
-            continue
-        print("\nSummary:")
-        print(summary)
-
-        #  Step 2: Extract Morphology from Summary
-        print("\nExtracting Morphology...")
-        morphology_text = call_llama_subprocess(summary, morphology_extraction_instructions)
-        if "Error" in morphology_text:
-            print(f"Morphology extraction failed: {morphology_text}")
-            continue
-        print("\nExtracted Morphology:")
-        print(morphology_text)
-
-        #  Step 3: Extract Topography from Summary
-        print("\nExtracting Topography...")
-        topography_text = call_llama_subprocess(summary, topography_extraction_instructions)
-        if "Error" in topography_text:
-            print(f"Topography extraction failed: {topography_text}")
-            continue
-        print("\nExtracted Topography:")
-        print(topography_text)
-
-        #  Step 4: Retrieve Topography Code using RAG
-        print("\nFinding Topography Code using RAG...")
-        topography_result = rag_query(topography_text, topography_vectorstore)
-        print("\nTopography Code retrieved:")
-        print(topography_result)
-
-        #  Step 5: Retrieve Morphology Code using RAG
-        print("\nFinding Morphology Code using RAG...")
-        morphology_result = rag_query(morphology_text, morphology_vectorstore)
-        print("\nMorphology Code Retrieved:")
-        print(morphology_result)
-        
-        #  Step 6: Finalize the Best Topography Code
-        final_topography_code = validate_topography_code(topography_text, topography_result)
-        print("\nFinal Topography Code:", final_topography_code)
-
-        #  Step 7: Finalize the Best Morphology Code
-        final_morphology_code = validate_morphology_code(morphology_text, morphology_result)
-        print("\nFinal Morphology Code:", final_morphology_code)
+        code_report(user_input)
 
         #  Free memory
         gc.collect()
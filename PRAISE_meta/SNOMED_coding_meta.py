@@ -1,7 +1,13 @@
+import os
+import sys
+import csv
+from functools import partial
 from llama import Llama
+from worker_pool import run_worker_pool
 import fire
 import gc
-from typing import Optional
+from typing import List, Optional, Tuple
+from codebook import MORPHOLOGY_TOP_N, TOPOGRAPHY_TOP_N, build_morphology_prompt, build_topography_prompt
 
 
 def generate_summary(generator, user_input: str, max_gen_len: Optional[int], temperature: float, top_p: float, max_seq_len: int) -> str:
@@ -50,27 +56,19 @@ def generate_summary(generator, user_input: str, max_gen_len: Optional[int], tem
     return summary
 
 
-def assign_snomed(generator, summary: str, max_gen_len: Optional[int], temperature: float, top_p: float, max_seq_len: int) -> str:
-    """Assign Tcode (Topogrpahy Codes) based on the summary."""
-    system_content = """
+def assign_snomed(generator, summary: str, max_gen_len: Optional[int], temperature: float, top_p: float, max_seq_len: int, top_n: Optional[int] = TOPOGRAPHY_TOP_N) -> Tuple[str, List[str]]:
+    """Assign Tcode (Topogrpahy Codes) based on the summary, offering only the top_n most relevant topography codes.
+
+    Returns the answer and the topography codes that were included in the prompt.
+    """
+    system_template = """
 	You are an expert SNOMED coding assistant. When provided with the topography of a case, you accurately assign the most precise SNOMED codes with confidence and consistency.
 	If the summarised report described the  topography or location of a tumor is 60 cm from the anal verge, then the toporgaohy is Descending colon. So, the SNOMED code for descending colon is 67200
 	You have been provided with a summarized pathology report highlighting the tumor's topography. Using the SNOMED codebook provided, your task is to assign the most appropriate SNOMED codes
 	for topography accurately.
  
         Topography Codes:
-	1. 67000	COLON, NOS
-	2. 67100	CECUM
-	3. 67200	ASCENDING COLON
-	4. 67400	TRANSVERSE COLON
-	5. 67600	DESCENDING COLON
-	6. 67700	SIGMOID COLON
-	7. 67800	MESENTERY OF COLON, MESOCOLON
-	8. 67950	COLON AND SKIN, CS
-	9. 67965	COLON, RIGHT
-	10. 67995	COLON, LEFT
-	11. 68000	RECTUM, NOS
-	12. 64000 	SMALL INTESTINE
+{codebook}
 
 
 	Distance to Topography Mapping:
@@ -98,6 +96,8 @@ def assign_snomed(generator, summary: str, max_gen_len: Optional[int], temperatu
 	5. Keep your response short and concise. So return in one line like "The topography  is " ----- "and its SNOMED code is"----
 
     """
+    system_content, included_codes = build_topography_prompt(system_template, summary, top_n)
+    print(f"\nTopography codebook entries included: {', '.join(included_codes)}")
     user_content = f"You have been provided with a summarized pathology report highlighting the tumor's detail. Using the SNOMED codebook provided, your task is to assign the most appropriate SNOMED codes for the topography, remember only topogrpahy. Summary: {summary}"
 
     # Tokenize and process the input
@@ -106,7 +106,7 @@ def assign_snomed(generator, summary: str, max_gen_len: Optional[int], temperatu
 
     if len(system_tokens) + len(user_tokens) > max_seq_len:
         print("Input exceeds the maximum sequence length.")
-        return ""
+        return "", included_codes
 
     dialog = [
         {"role": "system", "content": system_content},
@@ -122,12 +122,15 @@ def assign_snomed(generator, summary: str, max_gen_len: Optional[int], temperatu
     snomed_codes = response[0]["generation"]["content"]
     print("\nAssigned SNOMED Codes:")
     print(snomed_codes)
-    return snomed_codes
+    return snomed_codes, included_codes
 
 
-def assign_mcode(generator, summary: str, max_gen_len: Optional[int], temperature: float, top_p: float, max_seq_len: int) -> str:
-    """Assign Mcode (Morphology Codes) based on the summary."""
-    system_content = """
+def assign_mcode(generator, summary: str, max_gen_len: Optional[int], temperature: float, top_p: float, max_seq_len: int, top_n: Optional[int] = MORPHOLOGY_TOP_N) -> Tuple[str, List[str]]:
+    """Assign Mcode (Morphology Codes) based on the summary, offering only the top_n most relevant Mcodes.
+
+    Returns the answer and the Mcodes that were included in the prompt.
+    """
+    system_template = """
         You are an expert SNOMED coding assistant. When provided with the morphology of a case, you accurately assign the most precise SNOMED codes with confidence and consistency.
 	If the summarised report described the morphology of a tumor as Tubulovillous  adenoma,  then the SNOMED code of Tubulovillous  adenoma is 82630. 
 	You have been provided with a summarized pathology report highlighting the tumor's morphology. Using the SNOMED codebook provided, your task is to assign the most appropriate SNOMED codes
@@ -151,71 +154,17 @@ def assign_mcode(generator, summary: str, max_gen_len: Optional[int], temperatur
 	
 	The Mcode list and its corresponding Morphology are provided below:
 	Mcode   Morphology
-	M80102: CARCINOMA IN SITU
-	M80103: CARCINOMA, NOS
-	M80203: UNDIFFERENTIATED CARCINOMA
-	M80702:	Squamous cell carcinoma in situ, NOS
-	M80703:	Squamous cell carcinoma, NOS
-	M80706:	Squamous cell carcinoma, NOS, metastatic
-	M80709:	Squamous cell carcinoma, NOS, unknown if primary or metastatic
-	M81402: ADENOCARCINOMA IN-SITU
-	M81403: ADENOCARCINOMA, NOS
-	M82103: ADENOCARCINOMA IN ADENOMATOUS POLYP
-	M82203: ADENOCA ARISING FROM ADENOMATOUS POLYP
-	M82403: CARCINOID TUMOR, MALIGNANT
-	M82603: PAPILLARY ADENOCARCINOMA
-	M82613: ADENOCARCINOMA IN VILLOUS ADENOMA
-	M82632: Adenocarcinoma in situ in tubulovillous adenoma
-	M82636:	Adenocarcinoma in tubulovillous adenoma, metastatic
-	M82633: ADENOCARCINOMA IN TUBULOVILLOUS ADENOMA
-	M83803: ENDOMETRIOID CARCINOMA
-	M84103: SEBACEOUS CARCINOMA
-	M84803: MUCINOUS ADENOCARCINOMA
-	M84903: SIGNET RING CELL CARCINOMA
-	M88403: MYXOSARCOMA, MALIGNANT MYXOMA
-	M89303: STROMAL SARCOMA, ENDOMETRIAL STROMAL SARCOMA
-	M82630: TUBULOVILLOUS ADENOMA
-	M82110: TUBULAR ADENOMA
-	M43000: CHRONIC INFLAMMATION
-	M09450: NO EVIDENCE OF MALIGNANCY
-	M81406: ADENOCARCINOMA, METASTATIC
-	M81407: ADENOCARCINOMA, RECURRENT
-	M81404: ADENOCARCINOMA, CONTIGUOUS SPREAD
-	M82100: ADENOMATOUS POLYP
-	M82101:	Adenomatous polyp, NOS, uncertain, borderline
-	M88500: LIPOMA, NOS
-	M85603: ADENOSQUAMOUS CARCINOMA
-	M80213: ANAPLASTIC CARCINOMA
-	M82600: PAPILLARY ADENOMA
-	M84701: MUCINOUS CYSTADENOMA, BORDERLINE MALIGNANCY
-	M84030: ECCRINE SPIRADENOMA     
-	M82401: CARCINOID TUMOR, NOS
-	M82610: VILLOUS ADENOMA, NOS
-	M82611:	Villous adenoma, NOS, uncertain, borderline
-	M82612:	Adenocarcinoma in situ in villous adenoma
-	M81703	HEPATOCELLULAR CARCINOMA, HEPATOMA
-	M81409	ADENOCARCINOMA, 1' OR 2'
-	M84804	MUCINOUS ADENOCARCINOMA, CONTIGUOUS SPREAD
-	M81400	ADENOMA, NOS
-	M84807	MUCINOUS ADENOCARCINOMA, RECURRENT
-	M88900	LEIOMYOMA, NOS, FIBROMYOMA		
-	M82113	ADENOCARCINOMA IN TUBULAR ADENOMA 
-	M82112  ADENOCARCINOMA IN SITU IN TUBULAR ADENOMA
-	M80106	CARCINOMA, METASTATIC				
-	M84416	SEROUS CYSTADENOCARCINOMA, METASTATIC		
-	M81405	ADENOCARCINOMA, MICROINVASIVE	
-	M80127	LARGE CELL CARCINOMA, RECURRENT	
-	M85103	MEDULLARY CARCINOMA	
-	M82040	Lactating adenoma
-	M87402	 melanoma in junctional nevus in situ, noninfiltrating, noninvasive
+{codebook}
 	
 	Important note:
 	- Do not perform any tasks beyond the specified objectives. Focus on assigning morphology code only.
 	- Use only SNOMED codes from the provided codebook. Do not use codes from external sources like ICD. Ensure all assigned codes are strictly from the provided list.
 	- When answering, do not hallucinate or make assumptions, and do not skip any steps or modify any parts of the morphology description.
-	- Keep your response short and concise. So return in one line like "The morphology is " ----- "and its SNOMED code is"----""".
+	- Keep your response short and concise. So return in one line like "The morphology is " ----- "and its SNOMED code is"----
 	
     """
+    system_content, included_codes = build_morphology_prompt(system_template, summary, top_n)
+    print(f"\nMorphology codebook entries included: {', '.join(included_codes)}")
     user_content = f"You have been provided with a summarized pathology report highlighting the tumor's detail. Using the SNOMED codebook provided, your task is to assign the most appropriate SNOMED codes for the morphology, remember only morphology: {summary}"
 
     # Tokenize and process the input
@@ -224,7 +173,7 @@ def assign_mcode(generator, summary: str, max_gen_len: Optional[int], temperatur
 
     if len(system_tokens) + len(user_tokens) > max_seq_len:
         print("Input exceeds the maximum sequence length.")
-        return ""
+        return "", included_codes
 
     dialog = [
         {"role": "system", "content": system_content},
@@ -240,7 +189,55 @@ def assign_mcode(generator, summary: str, max_gen_len: Optional[int], temperatur
     mcode = response[0]["generation"]["content"]
     print("\nAssigned Mcode:")
     print(mcode)
-    return mcode
+    return mcode, included_codes
+
+
+def load_generator(ckpt_dir: str, tokenizer_path: str, max_seq_len: int, max_batch_size: int, device: str = "cuda", quantize: bool = True, num_threads: Optional[int] = None):
+    """Load the Meta model on the GPU (via torchrun) or on the CPU."""
+    print("Loading model...")
+    if device == "cpu":
+        from cpu_generator import CPULlama, report_memory_footprint
+
+        # CPU-only nodes: int8 dynamic weight quantization (unless --quantize False) and multi-threaded matmuls
+        generator = CPULlama.build(
+            ckpt_dir=ckpt_dir,
+            tokenizer_path=tokenizer_path,
+            max_seq_len=max_seq_len,
+            max_batch_size=max_batch_size,
+            quantize=quantize,
+            num_threads=num_threads,
+        )
+        report_memory_footprint(generator)
+    else:
+        generator = Llama.build(
+            ckpt_dir=ckpt_dir,
+            tokenizer_path=tokenizer_path,
+            max_seq_len=max_seq_len,
+            max_batch_size=max_batch_size,
+        )
+    print("Model loaded successfully.")
+    return generator
+
+
+def code_report(generator, report: str, max_gen_len: Optional[int], temperature: float, top_p: float, max_seq_len: int, topography_top_n: Optional[int] = TOPOGRAPHY_TOP_N, morphology_top_n: Optional[int] = MORPHOLOGY_TOP_N) -> Optional[dict]:
+    """Run the three PRISM steps on one report. Returns None if the summary could not be generated."""
+    # Step 1: Generate summary
+    summary = generate_summary(generator, report, max_gen_len, temperature, top_p, max_seq_len)
+    if not summary.strip():
+        return None
+
+    # Step 2: Assign SNOMED codes
+    snomed_codes, topography_codebook = assign_snomed(generator, summary, max_gen_len, temperature, top_p, max_seq_len, topography_top_n)
+
+    # Step 3: Assign Mcode
+    mcode, morphology_codebook = assign_mcode(generator, summary, max_gen_len, temperature, top_p, max_seq_len, morphology_top_n)
+    return {
+        "Summary": summary,
+        "Topography": snomed_codes,
+        "Morphology": mcode,
+        "Topography codebook": " ".join(topography_codebook),
+        "Morphology codebook": " ".join(morphology_codebook),
+    }
 
 
 def main(
@@ -249,19 +246,67 @@ def main(
     temperature: float = 0,
     top_p: float = 0.9,
     max_seq_len: int = 8192,
-    max_batch_size: int = 6,
+    max_batch_size: Optional[int] = None,
     max_gen_len: Optional[int] = None,
+    device: str = "cuda",
+    quantize: bool = True,
+    num_threads: Optional[int] = None,
+    topography_top_n: Optional[int] = TOPOGRAPHY_TOP_N,
+    morphology_top_n: Optional[int] = MORPHOLOGY_TOP_N,
+    input_csv: Optional[str] = None,
+    output_csv: Optional[str] = None,
+    num_workers: int = 1,
 ):
+    if num_workers > 1 and device != "cpu":
+        raise ValueError("The worker pool forks after loading the model, which CUDA does not support. Use --device cpu.")
+    if num_workers > 1 and not input_csv:
+        raise ValueError("The worker pool codes the reports of a CSV. Pass --input_csv with --num_workers.")
+    if max_batch_size is None:
+        # PRISM codes one report at a time; on the CPU a larger batch only enlarges the KV cache
+        max_batch_size = 1 if device == "cpu" else 6
 
     # Load the model once
-    print("Loading model...")
-    generator = Llama.build(
-	ckpt_dir=ckpt_dir,
-	tokenizer_path=tokenizer_path,
-	max_seq_len=max_seq_len,
-	max_batch_size=max_batch_size,
+    generator = load_generator(ckpt_dir, tokenizer_path, max_seq_len, max_batch_size, device, quantize, num_threads)
+
+    code = partial(
+        code_report,
+        max_gen_len=max_gen_len,
+        temperature=temperature,
+        top_p=top_p,
+        max_seq_len=max_seq_len,
+        topography_top_n=topography_top_n,
+        morphology_top_n=morphology_top_n,
     )
-    print("Model loaded successfully.")
+
+    # Batch mode: code every report of a CSV (column "Report") and write the results next to the input columns
+    if input_csv:
+        with open(input_csv, newline="", encoding="utf-8") as f:
+            reader = csv.DictReader(f)
+            fieldnames = reader.fieldnames + ["Summary", "Topography", "Morphology", "Topography codebook", "Morphology codebook"]
+            rows = list(reader)
+        reports = [row["Report"] for row in rows]
+
+        if num_workers > 1:
+            # Workers are forked from this process and share the loaded weights
+            results = run_worker_pool(generator, code, reports, num_workers)
+        else:
+            results = []
+            for index, report in enumerate(reports):
+                # A failing report is left uncoded, as in the worker pool, so the rest of the CSV is still written
+                try:
+                    results.append(code(generator, report))
+                except Exception as e:
+                    sys.stderr.write(f"Error processing report {index}: {e}\n")
+                    results.append(None)
+
+        output_csv = output_csv or os.path.splitext(input_csv)[0] + "_coded.csv"
+        with open(output_csv, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer.writeheader()
+            for row, result in zip(rows, results):
+                writer.writerow({**row, **(result or {})})
+        print(f"Coded {sum(result is not None for result in results)}/{len(rows)} reports, written to {output_csv}")
+        return
 
     while True:
         print("\nEnter your pathology report (or type 'exit' to quit):")
@@ -271,18 +316,10 @@ def main(
             print("Exiting the program.")
             break
 
-        # Step 1: Generate summary
-        summary = generate_summary(generator, user_input, max_gen_len, temperature, top_p, max_seq_len)
-        if not summary.strip():
+        if code(generator, user_input) is None:
             print("Summary generation failed. Please try again.")
             continue
 
-        # Step 2: Assign SNOMED codes
-        snomed_codes = assign_snomed(generator, summary, max_gen_len, temperature, top_p, max_seq_len)
-
-        # Step 3: Assign Mcode
-        assign_mcode(generator, summary, max_gen_len, temperature, top_p, max_seq_len)
-
         # Release GPU memory
         gc.collect()
         print("Completed processing.\n")
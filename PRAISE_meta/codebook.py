@@ -0,0 +1,189 @@
+import math
+import re
+from typing import List, Optional, Sequence, Tuple
+
+# SNOMED codebooks used by the PRISM prompts, in the order they are listed in the prompts
+TOPOGRAPHY_CODEBOOK = [
+    ("67000", "COLON, NOS"),
+    ("67100", "CECUM"),
+    ("67200", "ASCENDING COLON"),
+    ("67400", "TRANSVERSE COLON"),
+    ("67600", "DESCENDING COLON"),
+    ("67700", "SIGMOID COLON"),
+    ("67800", "MESENTERY OF COLON, MESOCOLON"),
+    ("67950", "COLON AND SKIN, CS"),
+    ("67965", "COLON, RIGHT"),
+    ("67995", "COLON, LEFT"),
+    ("68000", "RECTUM, NOS"),
+    ("64000", "SMALL INTESTINE"),
+]
+
+MORPHOLOGY_CODEBOOK = [
+    ("M80102", "CARCINOMA IN SITU"),
+    ("M80103", "CARCINOMA, NOS"),
+    ("M80203", "UNDIFFERENTIATED CARCINOMA"),
+    ("M80702", "Squamous cell carcinoma in situ, NOS"),
+    ("M80703", "Squamous cell carcinoma, NOS"),
+    ("M80706", "Squamous cell carcinoma, NOS, metastatic"),
+    ("M80709", "Squamous cell carcinoma, NOS, unknown if primary or metastatic"),
+    ("M81402", "ADENOCARCINOMA IN-SITU"),
+    ("M81403", "ADENOCARCINOMA, NOS"),
+    ("M82103", "ADENOCARCINOMA IN ADENOMATOUS POLYP"),
+    ("M82203", "ADENOCA ARISING FROM ADENOMATOUS POLYP"),
+    ("M82403", "CARCINOID TUMOR, MALIGNANT"),
+    ("M82603", "PAPILLARY ADENOCARCINOMA"),
+    ("M82613", "ADENOCARCINOMA IN VILLOUS ADENOMA"),
+    ("M82632", "Adenocarcinoma in situ in tubulovillous adenoma"),
+    ("M82636", "Adenocarcinoma in tubulovillous adenoma, metastatic"),
+    ("M82633", "ADENOCARCINOMA IN TUBULOVILLOUS ADENOMA"),
+    ("M83803", "ENDOMETRIOID CARCINOMA"),
+    ("M84103", "SEBACEOUS CARCINOMA"),
+    ("M84803", "MUCINOUS ADENOCARCINOMA"),
+    ("M84903", "SIGNET RING CELL CARCINOMA"),
+    ("M88403", "MYXOSARCOMA, MALIGNANT MYXOMA"),
+    ("M89303", "STROMAL SARCOMA, ENDOMETRIAL STROMAL SARCOMA"),
+    ("M82630", "TUBULOVILLOUS ADENOMA"),
+    ("M82110", "TUBULAR ADENOMA"),
+    ("M43000", "CHRONIC INFLAMMATION"),
+    ("M09450", "NO EVIDENCE OF MALIGNANCY"),
+    ("M81406", "ADENOCARCINOMA, METASTATIC"),
+    ("M81407", "ADENOCARCINOMA, RECURRENT"),
+    ("M81404", "ADENOCARCINOMA, CONTIGUOUS SPREAD"),
+    ("M82100", "ADENOMATOUS POLYP"),
+    ("M82101", "Adenomatous polyp, NOS, uncertain, borderline"),
+    ("M88500", "LIPOMA, NOS"),
+    ("M85603", "ADENOSQUAMOUS CARCINOMA"),
+    ("M80213", "ANAPLASTIC CARCINOMA"),
+    ("M82600", "PAPILLARY ADENOMA"),
+    ("M84701", "MUCINOUS CYSTADENOMA, BORDERLINE MALIGNANCY"),
+    ("M84030", "ECCRINE SPIRADENOMA"),
+    ("M82401", "CARCINOID TUMOR, NOS"),
+    ("M82610", "VILLOUS ADENOMA, NOS"),
+    ("M82611", "Villous adenoma, NOS, uncertain, borderline"),
+    ("M82612", "Adenocarcinoma in situ in villous adenoma"),
+    ("M81703", "HEPATOCELLULAR CARCINOMA, HEPATOMA"),
+    ("M81409", "ADENOCARCINOMA, 1' OR 2'"),
+    ("M84804", "MUCINOUS ADENOCARCINOMA, CONTIGUOUS SPREAD"),
+    ("M81400", "ADENOMA, NOS"),
+    ("M84807", "MUCINOUS ADENOCARCINOMA, RECURRENT"),
+    ("M88900", "LEIOMYOMA, NOS, FIBROMYOMA"),
+    ("M82113", "ADENOCARCINOMA IN TUBULAR ADENOMA"),
+    ("M82112", "ADENOCARCINOMA IN SITU IN TUBULAR ADENOMA"),
+    ("M80106", "CARCINOMA, METASTATIC"),
+    ("M84416", "SEROUS CYSTADENOCARCINOMA, METASTATIC"),
+    ("M81405", "ADENOCARCINOMA, MICROINVASIVE"),
+    ("M80127", "LARGE CELL CARCINOMA, RECURRENT"),
+    ("M85103", "MEDULLARY CARCINOMA"),
+    ("M82040", "Lactating adenoma"),
+    ("M87402", "melanoma in junctional nevus in situ, noninfiltrating, noninvasive"),
+]
+
+# Entries always offered to the model, whatever the ranking: the NOS/regional sites and the most frequent morphologies
+TOPOGRAPHY_FALLBACK = ["67000", "67965", "67995", "68000"]
+MORPHOLOGY_FALLBACK = ["M80103", "M81402", "M81403", "M81400", "M43000", "M09450"]
+
+# Default number of ranked entries kept in a prompt (None keeps the full codebook)
+TOPOGRAPHY_TOP_N = 5
+MORPHOLOGY_TOP_N = 10
+
+# Distance from the anal verge (cm) to anatomical site, as in the topography prompts
+DISTANCE_TO_TOPOGRAPHY = [
+    (4, "Anus"),
+    (15, "Rectum"),
+    (17, "Rectosigmoid Junction"),
+    (57, "Sigmoid Colon"),
+    (82, "Descending Colon"),
+    (132, "Transverse Colon"),
+    (147, "Ascending Colon"),
+    (math.inf, "Cecum"),
+]
+
+# "tumor" appears in nearly every report, so on its own it would pull the carcinoid entries into every prompt
+_STOPWORDS = {"a", "and", "arising", "from", "in", "is", "its", "nos", "of", "or", "the", "tumor", "tumour", "with"}
+_SYNONYMS = {"adenoca": "adenocarcinoma", "ca": "carcinoma", "cecal": "cecum", "rectal": "rectum", "colonic": "colon"}
+_DISTANCE = re.compile(r"(\d+(?:\.\d+)?)\s*cm\b[^.]{0,20}?anal verge", re.IGNORECASE)
+
+
+def _tokens(text: str) -> List[str]:
+    text = text.lower().replace("in-situ", "in situ")
+    tokens = []
+    # Primed numbers ("1' OR 2'") are kept so those entries do not tie with their NOS counterparts
+    for word in re.findall(r"[a-z]+|\d+'", text):
+        if word in _STOPWORDS:
+            continue
+        word = _SYNONYMS.get(word, word)
+        # Crude plural folding: adenomas -> adenoma, polyps -> polyp
+        if len(word) > 4 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        tokens.append(word)
+    return tokens
+
+
+def distance_to_topography(text: str) -> List[str]:
+    """Map every "<n> cm from the anal verge" in the text to its anatomical site."""
+    sites = []
+    for match in _DISTANCE.finditer(text):
+        distance = float(match.group(1))
+        sites.append(next(site for upper, site in DISTANCE_TO_TOPOGRAPHY if distance <= upper))
+    return sites
+
+
+def rank_codebook(query: str, codebook: Sequence[Tuple[str, str]]) -> List[Tuple[float, str]]:
+    """Score codebook entries against the query by IDF-weighted term coverage, best first (zero scores dropped)."""
+    entry_tokens = {code: set(_tokens(term)) for code, term in codebook}
+    document_frequency = {}
+    for tokens in entry_tokens.values():
+        for token in tokens:
+            document_frequency[token] = document_frequency.get(token, 0) + 1
+    idf = {token: math.log((len(codebook) + 1) / (df + 1)) + 1 for token, df in document_frequency.items()}
+
+    query_tokens = set(_tokens(query))
+    scores = []
+    for code, tokens in entry_tokens.items():
+        total = sum(idf[token] for token in tokens)
+        matched = sum(idf[token] for token in tokens if token in query_tokens)
+        if matched:
+            # Coverage favours entries whose whole term appears; the matched weight favours the more specific ones
+            scores.append((matched * matched / total, code))
+    return sorted(scores, key=lambda score: -score[0])
+
+
+def select_codebook_entries(
+    query: str,
+    codebook: Sequence[Tuple[str, str]],
+    top_n: Optional[int],
+    fallback_codes: Sequence[str] = (),
+    min_relative_score: float = 0.5,
+) -> List[Tuple[str, str]]:
+    """Keep the top_n ranked entries plus the fallback set, in codebook order. top_n=None keeps everything.
+
+    Ranked entries scoring below min_relative_score of the best match (e.g. sites sharing only "colon") are dropped.
+    """
+    if top_n is None:
+        return list(codebook)
+    ranked = rank_codebook(query, codebook)[:top_n]
+    keep = set(fallback_codes)
+    keep.update(code for score, code in ranked if score >= ranked[0][0] * min_relative_score)
+    return [(code, term) for code, term in codebook if code in keep]
+
+
+def build_topography_prompt(template: str, summary: str, top_n: Optional[int] = TOPOGRAPHY_TOP_N) -> Tuple[str, List[str]]:
+    """Fill the {codebook} placeholder of a topography prompt with the entries relevant to the summary.
+
+    Returns the prompt and the codes that were included in it.
+    """
+    # Distances are ranked through the site they map to
+    query = " ".join([summary] + distance_to_topography(summary))
+    entries = select_codebook_entries(query, TOPOGRAPHY_CODEBOOK, top_n, TOPOGRAPHY_FALLBACK)
+    codebook = "\n".join(f"{i}. {code}\t{term}" for i, (code, term) in enumerate(entries, start=1))
+    return template.replace("{codebook}", codebook), [code for code, _ in entries]
+
+
+def build_morphology_prompt(template: str, summary: str, top_n: Optional[int] = MORPHOLOGY_TOP_N) -> Tuple[str, List[str]]:
+    """Fill the {codebook} placeholder of a morphology prompt with the entries relevant to the summary.
+
+    Returns the prompt and the codes that were included in it.
+    """
+    entries = select_codebook_entries(summary, MORPHOLOGY_CODEBOOK, top_n, MORPHOLOGY_FALLBACK)
+    codebook = "\n".join(f"{code}: {term}" for code, term in entries)
+    return template.replace("{codebook}", codebook), [code for code, _ in entries]
@@ -0,0 +1,237 @@
+import json
+import os
+import resource
+from contextlib import contextmanager
+from pathlib import Path
+from typing import List, Optional
+
+import fire
+import torch
+import torch.nn as nn
+from fairscale.nn.model_parallel.initialize import (
+    initialize_model_parallel,
+    model_parallel_is_initialized,
+)
+from fairscale.nn.model_parallel.layers import ColumnParallelLinear, RowParallelLinear
+from llama import Llama
+from llama.generation import sample_top_p
+from llama.model import ModelArgs, Transformer, precompute_freqs_cis
+from llama.tokenizer import Tokenizer
+
+
+def _init_cpu_process_group():
+    """Set up a single-process gloo group so the fairscale layers can be built without CUDA or torchrun."""
+    if not torch.distributed.is_initialized():
+        # An in-process store binds no TCP port, so several CPU jobs can run on the same host
+        torch.distributed.init_process_group("gloo", store=torch.distributed.HashStore(), rank=0, world_size=1)
+    if not model_parallel_is_initialized():
+        initialize_model_parallel(1)
+
+
+@contextmanager
+def _cuda_as_cpu():
+    """Meta's Transformer allocates its KV cache with `.cuda()`; keep those tensors on the CPU instead."""
+    tensor_cuda = torch.Tensor.cuda
+    torch.Tensor.cuda = lambda self, *args, **kwargs: self
+    try:
+        yield
+    finally:
+        torch.Tensor.cuda = tensor_cuda
+
+
+def _replace_parallel_linears(model: nn.Module):
+    """Swap fairscale parallel linears (identity wrappers at model parallel size 1) for nn.Linear so they can be quantized."""
+    for module in model.modules():
+        for child_name, child in list(module.named_children()):
+            if isinstance(child, (ColumnParallelLinear, RowParallelLinear)):
+                linear = nn.Linear(child.in_features, child.out_features, bias=child.bias is not None)
+                linear.weight = child.weight
+                if child.bias is not None:
+                    linear.bias = child.bias
+                setattr(module, child_name, linear)
+
+
+def _load_block(block: nn.Module, prefix: str, checkpoint: dict, quantize: bool):
+    """Materialise one block of a meta-device model from the checkpoint, then quantize its linears."""
+    block.to_empty(device="cpu")
+    block.load_state_dict({key[len(prefix):]: value for key, value in checkpoint.items() if key.startswith(prefix)})
+    if quantize:
+        torch.ao.quantization.quantize_dynamic(block, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+class CPULlama(Llama):
+    """Llama generator that runs on the CPU, optionally with int8 dynamic weight quantization."""
+
+    @staticmethod
+    def build(
+        ckpt_dir: str,
+        tokenizer_path: str,
+        max_seq_len: int,
+        max_batch_size: int,
+        quantize: bool = True,
+        num_threads: Optional[int] = None,
+        seed: int = 1,
+    ) -> "CPULlama":
+        _init_cpu_process_group()
+        torch.manual_seed(seed)
+        if num_threads:
+            # Threads used by the (quantized) matmuls
+            torch.set_num_threads(num_threads)
+
+        checkpoints = sorted(Path(ckpt_dir).glob("*.pth"))
+        assert len(checkpoints) == 1, f"CPU mode expects a single checkpoint file in {ckpt_dir}, found {len(checkpoints)}"
+        # Memory-map the checkpoint so loading does not hold a second full copy of the weights in RAM
+        checkpoint = torch.load(checkpoints[0], map_location="cpu", mmap=True)
+        with open(Path(ckpt_dir) / "params.json", "r") as f:
+            params = json.loads(f.read())
+
+        model_args = ModelArgs(max_seq_len=max_seq_len, max_batch_size=max_batch_size, **params)
+        tokenizer = Tokenizer(model_path=tokenizer_path)
+        assert model_args.vocab_size == tokenizer.n_words
+
+        # Weights are kept in float32 on the CPU: dynamic quantization and the fp32 fallback kernels both expect it
+        torch.set_default_dtype(torch.float32)
+        # Build on the meta device and load one block at a time, so that only a single block is ever held in
+        # float32 instead of the whole model (4x the bf16 checkpoint)
+        with _cuda_as_cpu(), torch.device("meta"):
+            model = Transformer(model_args)
+            _replace_parallel_linears(model)
+        _load_block(model.tok_embeddings, "tok_embeddings.", checkpoint, quantize=False)
+        for layer_id, layer in enumerate(model.layers):
+            _load_block(layer, f"layers.{layer_id}.", checkpoint, quantize)
+        _load_block(model.norm, "norm.", checkpoint, quantize=False)
+        _load_block(model.output, "output.", checkpoint, quantize=False)
+        del checkpoint
+        if quantize:
+            # Only the output projection is left: quantize_dynamic swaps children, not the module it is given
+            model = torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+        # Tensors that are plain attributes rather than parameters were created on the meta device
+        model.freqs_cis = precompute_freqs_cis(model_args.dim // model_args.n_heads, max_seq_len * 2, model_args.rope_theta)
+        for layer in model.layers:
+            layer.attention.cache_k = torch.zeros(layer.attention.cache_k.shape)
+            layer.attention.cache_v = torch.zeros(layer.attention.cache_v.shape)
+        model.eval()
+        return CPULlama(model, tokenizer)
+
+    @torch.inference_mode()
+    def generate(
+        self,
+        prompt_tokens: List[List[int]],
+        max_gen_len: int,
+        temperature: float = 0.6,
+        top_p: float = 0.9,
+        logprobs: bool = False,
+        echo: bool = False,
+    ):
+        """Same decoding loop as Llama.generate, with every tensor kept on the CPU."""
+        if logprobs:
+            raise NotImplementedError("CPULlama does not compute logprobs; call chat_completion with logprobs=False")
+        params = self.model.params
+        bsz = len(prompt_tokens)
+        assert bsz <= params.max_batch_size, (bsz, params.max_batch_size)
+
+        min_prompt_len = min(len(t) for t in prompt_tokens)
+        max_prompt_len = max(len(t) for t in prompt_tokens)
+        assert max_prompt_len <= params.max_seq_len
+        total_len = min(params.max_seq_len, max_gen_len + max_prompt_len)
+
+        pad_id = self.tokenizer.pad_id
+        tokens = torch.full((bsz, total_len), pad_id, dtype=torch.long)
+        for k, t in enumerate(prompt_tokens):
+            tokens[k, : len(t)] = torch.tensor(t, dtype=torch.long)
+
+        prev_pos = 0
+        eos_reached = torch.tensor([False] * bsz)
+        input_text_mask = tokens != pad_id
+        stop_tokens = torch.tensor(list(self.tokenizer.stop_tokens))
+
+        for cur_pos in range(min_prompt_len, total_len):
+            logits = self.model.forward(tokens[:, prev_pos:cur_pos], prev_pos)
+            if temperature > 0:
+                probs = torch.softmax(logits[:, -1] / temperature, dim=-1)
+                next_token = sample_top_p(probs, top_p)
+            else:
+                next_token = torch.argmax(logits[:, -1], dim=-1)
+
+            next_token = next_token.reshape(-1)
+            # Only replace the token if the prompt has already been consumed
+            next_token = torch.where(input_text_mask[:, cur_pos], tokens[:, cur_pos], next_token)
+            tokens[:, cur_pos] = next_token
+            eos_reached |= (~input_text_mask[:, cur_pos]) & torch.isin(next_token, stop_tokens)
+            prev_pos = cur_pos
+            if all(eos_reached):
+                break
+
+        out_tokens = []
+        for i, toks in enumerate(tokens.tolist()):
+            start = 0 if echo else len(prompt_tokens[i])
+            toks = toks[start : len(prompt_tokens[i]) + max_gen_len]
+            for stop_token in self.tokenizer.stop_tokens:
+                if stop_token in toks:
+                    toks = toks[: toks.index(stop_token)]
+            out_tokens.append(toks)
+        return (out_tokens, None)
+
+
+def _state_bytes(value) -> int:
+    # Dynamically quantized linears store their weights as a packed (int8 weight, bias) tuple
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, (tuple, list)):
+        return sum(_state_bytes(v) for v in value)
+    return 0
+
+
+def report_memory_footprint(generator: Llama) -> dict:
+    """Print and return the weight, KV cache and peak process memory of a loaded generator (in bytes)."""
+    weight_bytes = sum(_state_bytes(value) for value in generator.model.state_dict().values())
+    cache_bytes = sum(
+        _state_bytes(layer.attention.cache_k) + _state_bytes(layer.attention.cache_v)
+        for layer in generator.model.layers
+    )
+    # ru_maxrss is reported in kilobytes on Linux
+    peak_rss_bytes = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    gib = 1024 ** 3
+    print(f"Model weights:    {weight_bytes / gib:.2f} GiB")
+    print(f"KV cache:         {cache_bytes / gib:.2f} GiB")
+    print(f"Peak process RSS: {peak_rss_bytes / gib:.2f} GiB")
+    return {"weights": weight_bytes, "kv_cache": cache_bytes, "peak_rss": peak_rss_bytes}
+
+
+def save_random_checkpoint(
+    ckpt_dir: str,
+    tokenizer_path: str,
+    dim: int = 256,
+    n_layers: int = 2,
+    n_heads: int = 4,
+    n_kv_heads: int = 2,
+    multiple_of: int = 64,
+    seed: int = 0,
+):
+    """Write a tiny randomly initialized checkpoint (params.json + consolidated.00.pth) for testing the CPU path."""
+    _init_cpu_process_group()
+    torch.manual_seed(seed)
+    params = {
+        "dim": dim,
+        "n_layers": n_layers,
+        "n_heads": n_heads,
+        "n_kv_heads": n_kv_heads,
+        "vocab_size": Tokenizer(model_path=tokenizer_path).n_words,
+        "multiple_of": multiple_of,
+        "norm_eps": 1e-5,
+        "rope_theta": 500000.0,
+    }
+    with _cuda_as_cpu():
+        model = Transformer(ModelArgs(max_seq_len=128, max_batch_size=1, **params))
+
+    os.makedirs(ckpt_dir, exist_ok=True)
+    with open(Path(ckpt_dir) / "params.json", "w") as f:
+        json.dump(params, f, indent=2)
+    torch.save(model.state_dict(), Path(ckpt_dir) / "consolidated.00.pth")
+    print(f"Random checkpoint written to {ckpt_dir}")
+
+
+if __name__ == "__main__":
+    fire.Fire({"random_checkpoint": save_random_checkpoint})
@@ -0,0 +1,91 @@
+import multiprocessing as mp
+import os
+import queue
+import sys
+from typing import Callable, List, Sequence
+
+try:
+    import torch
+except ImportError:  # The Ollama pipelines use the pool without PyTorch
+    torch = None
+
+# Generator loaded by the coordinator before forking; every worker inherits it, so the weights are
+# shared copy-on-write instead of being loaded once per worker. Python refcounting only touches the
+# tensor objects, not their storage, so the weight pages stay shared. Each worker writes only to its
+# own KV cache.
+_generator = None
+
+
+def _worker(task_queue, result_queue, work_fn: Callable, num_threads: int):
+    # Workers stay quiet like the non-zero ranks of Llama.build; the coordinator reports progress
+    sys.stdout = open(os.devnull, "w")
+    if torch is not None:
+        # Set before the first op, while the OpenMP runtime inherited from the coordinator is still unused
+        torch.set_num_threads(num_threads)
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        index, item = task
+        try:
+            result = work_fn(_generator, item)
+        except Exception as e:
+            sys.stderr.write(f"Error processing report {index}: {e}\n")
+            result = None
+        result_queue.put((index, result))
+
+
+def run_worker_pool(
+    generator,
+    work_fn: Callable,
+    items: Sequence,
+    num_workers: int,
+    threads_per_worker: int = 1,
+) -> List:
+    """Run work_fn(generator, item) over items in num_workers forked processes sharing one loaded generator.
+
+    Results are returned in input order, with None for items that failed or were left when every worker died.
+    A Meta generator must live on the CPU: CUDA cannot be re-initialised in a forked child.
+
+    Workers run single-threaded by default, like PyTorch's DataLoader workers: the coordinator has already run
+    OpenMP regions while loading the model, and GNU libgomp can hang when a forked child starts a thread team.
+    """
+    global _generator
+    _generator = generator
+
+    ctx = mp.get_context("fork")
+    task_queue = ctx.Queue()
+    result_queue = ctx.Queue()
+    for task in enumerate(items):
+        task_queue.put(task)
+    for _ in range(num_workers):
+        task_queue.put(None)
+
+    workers = [
+        ctx.Process(target=_worker, args=(task_queue, result_queue, work_fn, threads_per_worker))
+        for _ in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
+
+    results = [None] * len(items)
+    collected = 0
+    while collected < len(items):
+        try:
+            index, result = result_queue.get(timeout=1)
+        except queue.Empty:
+            if any(worker.is_alive() for worker in workers):
+                continue
+            # A worker may have flushed its last result just before exiting
+            try:
+                index, result = result_queue.get(timeout=1)
+            except queue.Empty:
+                sys.stderr.write(f"All workers exited after {collected} of {len(items)} reports; the rest are left uncoded\n")
+                break
+        results[index] = result
+        collected += 1
+        print(f"Completed report {collected}/{len(items)}")
+
+    for worker in workers:
+        worker.join()
+    return results
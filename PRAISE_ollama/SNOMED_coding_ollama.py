@@ -1,7 +1,13 @@
+import os
+import sys
 import subprocess
 import gc
 import time
 
+# Codebook pruning shared with the PRISM Meta script (PRAISE_meta/codebook.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "PRAISE_meta"))
+from codebook import MORPHOLOGY_TOP_N, TOPOGRAPHY_TOP_N, build_morphology_prompt, build_topography_prompt
+
 # Instructions for each step
 summarization_instructions = """
 You are a clinical language model specialized in pathology. You are highly skilled at summarizing pathology reports with clarity, precision, and clinical relevance.
@@ -30,18 +36,7 @@ You have been provided with a summarized pathology report highlighting the tumor
 for topography accurately.
 
  Topography Codes:
-1. 67000	COLON, NOS
-2. 67100	CECUM
-3. 67200	ASCENDING COLON
-4. 67400	TRANSVERSE COLON
-5. 67600	DESCENDING COLON
-6. 67700	SIGMOID COLON
-7. 67800	MESENTERY OF COLON, MESOCOLON
-8. 67950	COLON AND SKIN, CS
-9. 67965	COLON, RIGHT
-10. 67995	COLON, LEFT
-11. 68000	RECTUM, NOS
-12. 64000 	SMALL INTESTINE
+{codebook}
 
 
 Distance to Topography Mapping:
@@ -93,69 +88,14 @@ Step 2: Assign the Correct Mcode
 
 The Mcode list and its corresponding Morphology are provided below:
 Mcode   Morphology
-M80102: CARCINOMA IN SITU
-M80103: CARCINOMA, NOS
-M80203: UNDIFFERENTIATED CARCINOMA
-M80702:	Squamous cell carcinoma in situ, NOS
-M80703:	Squamous cell carcinoma, NOS
-M80706:	Squamous cell carcinoma, NOS, metastatic
-M80709:	Squamous cell carcinoma, NOS, unknown if primary or metastatic
-M81402: ADENOCARCINOMA IN-SITU
-M81403: ADENOCARCINOMA, NOS
-M82103: ADENOCARCINOMA IN ADENOMATOUS POLYP
-M82203: ADENOCA ARISING FROM ADENOMATOUS POLYP
-M82403: CARCINOID TUMOR, MALIGNANT
-M82603: PAPILLARY ADENOCARCINOMA
-M82613: ADENOCARCINOMA IN VILLOUS ADENOMA
-M82632: Adenocarcinoma in situ in tubulovillous adenoma
-M82636:	Adenocarcinoma in tubulovillous adenoma, metastatic
-M82633: ADENOCARCINOMA IN TUBULOVILLOUS ADENOMA
-M83803: ENDOMETRIOID CARCINOMA
-M84103: SEBACEOUS CARCINOMA
-M84803: MUCINOUS ADENOCARCINOMA
-M84903: SIGNET RING CELL CARCINOMA
-M88403: MYXOSARCOMA, MALIGNANT MYXOMA
-M89303: STROMAL SARCOMA, ENDOMETRIAL STROMAL SARCOMA
-M82630: TUBULOVILLOUS ADENOMA
-M82110: TUBULAR ADENOMA
-M43000: CHRONIC INFLAMMATION
-M09450: NO EVIDENCE OF MALIGNANCY
-M81406: ADENOCARCINOMA, METASTATIC
-M81407: ADENOCARCINOMA, RECURRENT
-M81404: ADENOCARCINOMA, CONTIGUOUS SPREAD
-M82100: ADENOMATOUS POLYP
-M82101:	Adenomatous polyp, NOS, uncertain, borderline
-M88500: LIPOMA, NOS
-M85603: ADENOSQUAMOUS CARCINOMA
-M80213: ANAPLASTIC CARCINOMA
-M82600: PAPILLARY ADENOMA
-M84701: MUCINOUS CYSTADENOMA, BORDERLINE MALIGNANCY
-M84030: ECCRINE SPIRADENOMA     
-M82401: CARCINOID TUMOR, NOS
-M82610: VILLOUS ADENOMA, NOS
-M82611:	Villous adenoma, NOS, uncertain, borderline
-M82612:	Adenocarcinoma in situ in villous adenoma
-M81703	HEPATOCELLULAR CARCINOMA, HEPATOMA
-M81409	ADENOCARCINOMA, 1' OR 2'
-M84804	MUCINOUS ADENOCARCINOMA, CONTIGUOUS SPREAD
-M81400	ADENOMA, NOS
-M84807	MUCINOUS ADENOCARCINOMA, RECURRENT
-M88900	LEIOMYOMA, NOS, FIBROMYOMA		
-M82113	ADENOCARCINOMA IN TUBULAR ADENOMA 
-M82112  ADENOCARCINOMA IN SITU IN TUBULAR ADENOMA
-M80106	CARCINOMA, METASTATIC				
-M84416	SEROUS CYSTADENOCARCINOMA, METASTATIC		
-M81405	ADENOCARCINOMA, MICROINVASIVE	
-M80127	LARGE CELL CARCINOMA, RECURRENT	
-M85103	MEDULLARY CARCINOMA	
-M82040	Lactating adenoma
-M87402	 melanoma in junctional nevus in situ, noninfiltrating, noninvasive
+{codebook}
 
 Important note:
 - Do not perform any tasks beyond the specified objectives. Focus on assigning morphology code only.
 - Use only SNOMED codes from the provided codebook. Do not use codes from external sources like ICD. Ensure all assigned codes are strictly from the provided list.
 - When answering, do not hallucinate or make assumptions, and do not skip any steps or modify any parts of the morphology description.
-- Keep your response short and concise. So return in one line like "The morphology is " ----- "and its SNOMED code is"----""".
+- Keep your response short and concise. So return in one line like "The morphology is " ----- "and its SNOMED code is"----
+"""
 
 
 # Docker constants
@@ -187,6 +127,46 @@ def call_llama_subprocess(content, instructions):
         print(f"Error interacting with Docker container: {e}")
         return "Error: Docker interaction failed"
 
+def code_report(report):
+    """Run the three PRISM steps on one report. Returns None if a step failed."""
+    # Step 1: Summarization
+    print("\nProcessing Summarization...")
+    summary = call_llama_subprocess(report, summarization_instructions)
+    if "Error" in summary:
+        print(f"Summarization failed: {summary}")
+        return None
+    print("\nSummary:")
+    print(summary)
+
+    # Step 2: Topography Code Assignment
+    print("\nAssigning Topography Code...")
+    instructions, topography_codebook = build_topography_prompt(topography_instructions, summary, TOPOGRAPHY_TOP_N)
+    print(f"Topography codebook entries included: {', '.join(topography_codebook)}")
+    topography_code = call_llama_subprocess(summary, instructions)
+    if "Error" in topography_code:
+        print(f"Topography assignment failed: {topography_code}")
+        return None
+    print("\nTopography Code Assigned:")
+    print(topography_code)
+
+    # Step 3: Morphology Code Assignment
+    print("\nAssigning Morphology Codes...")
+    instructions, morphology_codebook = build_morphology_prompt(morphology_instructions, summary, MORPHOLOGY_TOP_N)
+    print(f"Morphology codebook entries included: {', '.join(morphology_codebook)}")
+    morphology_codes = call_llama_subprocess(summary, instructions)
+    if "Error" in morphology_codes:
+        print(f"Morphology assignment failed: {morphology_codes}")
+        return None
+    print("\nMorphology Codes Assigned:")
+    print(morphology_codes)
+    return {
+        "Summary": summary,
+        "Topography": topography_code,
+        "Morphology": morphology_codes,
+        "Topography codebook": " ".join(topography_codebook),
+        "Morphology codebook": " ".join(morphology_codebook),
+    }
+
 def main():
     while True:
         print("\nEnter your pathology report (or type 'exit' to quit):")
@@ -196,32 +176,7 @@ def main():
             print("Exiting the program.")
             break
 
-        # Step 1: Summarization
-        print("\nProcessing Summarization...")
-        summary = call_llama_subprocess(user_input, summarization_instructions)
-        if "Error" in summary:
-            print(f"Summarization failed: {summary}")
-            continue
-        print("\nSummary:")
-        print(summary)
-
-        # Step 2: Topography Code Assignment
-        print("\nAssigning Topography Code...")
-        topography_code = call_llama_subprocess(summary, topography_instructions)
-        if "Error" in topography_code:
-            print(f"Topography assignment failed: {topography_code}")
-            continue
-        print("\nTopography Code Assigned:")
-        print(topography_code)
-
-        # Step 3: Morphology Code Assignment
-        print("\nAssigning Morphology Codes...")
-        morphology_codes = call_llama_subprocess(summary, morphology_instructions)
-        if "Error" in morphology_codes:
-            print(f"Morphology assignment failed: {morphology_codes}")
-            continue
-        print("\nMorphology Codes Assigned:")
-        print(morphology_codes)
+        code_report(user_input)
 
         # Release GPU memory
         gc.collect()
@@ -0,0 +1,256 @@
+import argparse
+import csv
+import importlib.machinery
+import importlib.util
+import os
+import re
+import sys
+import time
+from collections import Counter, defaultdict
+from functools import partial
+from typing import Dict, List, Optional
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "PRAISE_meta"))
+from codebook import MORPHOLOGY_CODEBOOK, TOPOGRAPHY_CODEBOOK
+from worker_pool import run_worker_pool
+
+# The four coding pipelines; each script exposes code_report(report) (code_report(generator, report, ...) for PRISM Meta)
+PIPELINES = {
+    "prism_meta": "PRAISE_meta/SNOMED_coding_meta.py",
+    "prism_ollama": "PRAISE_ollama/SNOMED_coding_ollama.py",
+    "rag_meta": "ERAG/ERAG_Meta/RAG_meta",
+    "rag_ollama": "ERAG/ERAG_Ollama/RAG_ollama.py",
+}
+
+_TOPOGRAPHY_CODES = {code for code, _ in TOPOGRAPHY_CODEBOOK}
+_MORPHOLOGY_CODES = {code for code, _ in MORPHOLOGY_CODEBOOK}
+
+
+def normalize_topography(code: str) -> Optional[str]:
+    """Gold topography label to a bare code: "#T-67600" -> "67600" (the first code of a multi-code label)."""
+    match = re.search(r"\d{5}", code or "")
+    return match.group(0) if match else None
+
+
+def normalize_morphology(code: str) -> Optional[str]:
+    """Gold morphology label to an Mcode: "M-81403" or "81403" -> "M81403"."""
+    match = re.search(r"\d{5}", code or "")
+    return f"M{match.group(0)}" if match else None
+
+
+# The prompts ask for "... and its SNOMED code is <code>"; codes may carry a T-/M- prefix, quotes or markdown
+_ANCHOR = r"SNOMED code is\W*"
+
+
+def parse_topography_code(text: str) -> Optional[str]:
+    """Topography code of a pipeline answer: the code after "SNOMED code is", else the first codebook code mentioned."""
+    text = text or ""
+    anchored = re.search(_ANCHOR + r"(?:T-?)?(\d{5})(?!\d)", text, re.IGNORECASE)
+    if anchored:
+        return anchored.group(1)
+    candidates = re.findall(r"(?<!\d)(\d{5})(?!\d)", text)
+    known = [code for code in candidates if code in _TOPOGRAPHY_CODES]
+    return (known or candidates or [None])[0]
+
+
+def parse_morphology_code(text: str) -> Optional[str]:
+    """Mcode of a pipeline answer: the code after "SNOMED code is", else the first codebook Mcode mentioned (with or without the leading M)."""
+    text = text or ""
+    anchored = re.search(_ANCHOR + r"(?:M-?)?(\d{5})(?!\d)", text, re.IGNORECASE)
+    if anchored:
+        return f"M{anchored.group(1)}"
+    candidates = [f"M{digits}" for digits in re.findall(r"(?<!\w)M?-?(\d{5})(?!\d)", text)]
+    known = [code for code in candidates if code in _MORPHOLOGY_CODES]
+    return (known or candidates or [None])[0]
+
+
+def _load_script(name: str, path: str):
+    # SourceFileLoader also handles scripts without a .py extension (RAG_meta)
+    loader = importlib.machinery.SourceFileLoader(name, path)
+    module = importlib.util.module_from_spec(importlib.util.spec_from_loader(name, loader))
+    loader.exec_module(module)
+    return module
+
+
+class Pipeline:
+    """A coding pipeline whose LLM calls are counted."""
+
+    def __init__(self, code_fn, llm_owner, llm_attr: str):
+        self.code_fn = code_fn
+        self.llm_calls = 0
+        llm_call = getattr(llm_owner, llm_attr)
+
+        def counted_call(*args, **kwargs):
+            self.llm_calls += 1
+            return llm_call(*args, **kwargs)
+
+        setattr(llm_owner, llm_attr, counted_call)
+
+
+def load_pipeline(name: str, args) -> Pipeline:
+    """Import one of the pipeline scripts (loading its model or vector stores) and wrap it for evaluation."""
+    module = _load_script(name, os.path.join(REPO_DIR, PIPELINES[name]))
+    if name == "prism_meta":
+        generator = module.load_generator(
+            args.ckpt_dir, args.tokenizer_path, args.max_seq_len, args.max_batch_size,
+            args.device, not args.no_quantize, args.num_threads,
+        )
+        top_n = {"topography_top_n": None, "morphology_top_n": None} if args.full_codebook else {}
+        code = partial(module.code_report, generator, max_gen_len=None, temperature=0, top_p=0.9, max_seq_len=args.max_seq_len, **top_n)
+        return Pipeline(code, generator, "chat_completion")
+
+    if name == "prism_ollama" and args.full_codebook:
+        module.TOPOGRAPHY_TOP_N = None
+        module.MORPHOLOGY_TOP_N = None
+    return Pipeline(module.code_report, module, "call_llama" if name == "rag_meta" else "call_llama_subprocess")
+
+
+def evaluate_report(pipeline: Pipeline, report: str) -> dict:
+    """Code one report and return the parsed codes, latency (s) and number of LLM calls."""
+    calls_before = pipeline.llm_calls
+    start = time.perf_counter()
+    try:
+        result = pipeline.code_fn(report) or {}
+    except Exception as e:
+        # A failing report counts as uncoded instead of aborting the run
+        sys.stderr.write(f"Error coding report: {e}\n")
+        result = {}
+    latency = time.perf_counter() - start
+    return {
+        "topography": parse_topography_code(result.get("Topography", "")),
+        "morphology": parse_morphology_code(result.get("Morphology", "")),
+        "latency": latency,
+        "llm_calls": pipeline.llm_calls - calls_before,
+        "topography_answer": result.get("Topography", ""),
+        "morphology_answer": result.get("Morphology", ""),
+        # Codebook entries offered by the pruned PRISM prompts (empty for the RAG pipelines)
+        "topography_codebook": result.get("Topography codebook", ""),
+        "morphology_codebook": result.get("Morphology codebook", ""),
+    }
+
+
+def confusion_matrix(gold: List[Optional[str]], predicted: List[Optional[str]]) -> Dict[str, Counter]:
+    """gold code -> Counter of predicted codes ("NONE" when no code could be parsed)."""
+    matrix = defaultdict(Counter)
+    for gold_code, predicted_code in zip(gold, predicted):
+        matrix[gold_code or "NONE"][predicted_code or "NONE"] += 1
+    return matrix
+
+
+def write_confusion_csv(path: str, matrix: Dict[str, Counter]):
+    predicted_codes = sorted({code for row in matrix.values() for code in row})
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["gold \\ predicted"] + predicted_codes)
+        for gold_code in sorted(matrix):
+            writer.writerow([gold_code] + [matrix[gold_code][code] for code in predicted_codes])
+
+
+def _print_per_code(title: str, matrix: Dict[str, Counter]):
+    print(f"\nPer-code results ({title}):")
+    for gold_code in sorted(matrix):
+        row = matrix[gold_code]
+        support = sum(row.values())
+        confusions = ", ".join(f"{code} x{count}" for code, count in row.most_common() if code != gold_code)
+        print(f"  {gold_code:<8} support {support:<4} correct {row[gold_code]:<4} confused with: {confusions or '-'}")
+
+
+def _percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[int(round(fraction * (len(ordered) - 1)))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Score a SNOMED coding pipeline against labelled reports (columns Report, SNOT, SNOM).")
+    parser.add_argument("pipeline", choices=sorted(PIPELINES))
+    parser.add_argument("labelled_csv")
+    parser.add_argument("--workers", type=int, default=1, help="Forked worker processes sharing the loaded pipeline")
+    parser.add_argument("--output_dir", help="Write per-report predictions and confusion matrices here")
+    parser.add_argument("--full_codebook", action="store_true", help="Disable codebook pruning in the PRISM prompts")
+    # PRISM Meta model settings (RAG Meta reads LLAMA_DEVICE / LLAMA_NUM_THREADS / LLAMA_QUANTIZE)
+    parser.add_argument("--ckpt_dir", default="/mnt/model")
+    parser.add_argument("--tokenizer_path", default="/mnt/model/tokenizer.model")
+    parser.add_argument("--device", default="cuda", help="cuda needs a torchrun launch; cpu runs under plain python")
+    parser.add_argument("--no_quantize", action="store_true")
+    parser.add_argument("--num_threads", type=int)
+    parser.add_argument("--max_seq_len", type=int, default=8192)
+    parser.add_argument("--max_batch_size", type=int, default=1)
+    args = parser.parse_args()
+
+    meta_on_gpu = (args.pipeline == "prism_meta" and args.device != "cpu") or (
+        args.pipeline == "rag_meta" and os.environ.get("LLAMA_DEVICE", "cuda") != "cpu"
+    )
+    if args.workers > 1 and meta_on_gpu:
+        parser.error("--workers > 1 forks the loaded model, which CUDA does not support; run the Meta pipelines on the CPU")
+
+    with open(args.labelled_csv, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    if not rows:
+        parser.error(f"{args.labelled_csv} contains no labelled reports")
+    reports = [row["Report"] for row in rows]
+    gold_topography = [normalize_topography(row["SNOT"]) for row in rows]
+    gold_morphology = [normalize_morphology(row["SNOM"]) for row in rows]
+
+    pipeline = load_pipeline(args.pipeline, args)
+    start = time.perf_counter()
+    if args.workers > 1:
+        results = run_worker_pool(pipeline, evaluate_report, reports, args.workers)
+    else:
+        results = [evaluate_report(pipeline, report) for report in reports]
+    wall_time = time.perf_counter() - start
+
+    # Reports whose worker failed count as uncoded
+    results = [result or {"topography": None, "morphology": None, "latency": None, "llm_calls": 0} for result in results]
+    predicted_topography = [result["topography"] for result in results]
+    predicted_morphology = [result["morphology"] for result in results]
+    topography_correct = sum(g is not None and g == p for g, p in zip(gold_topography, predicted_topography))
+    morphology_correct = sum(g is not None and g == p for g, p in zip(gold_morphology, predicted_morphology))
+    both_correct = sum(
+        gt is not None and gm is not None and gt == pt and gm == pm
+        for gt, pt, gm, pm in zip(gold_topography, predicted_topography, gold_morphology, predicted_morphology)
+    )
+    latencies = [result["latency"] for result in results if result["latency"] is not None]
+    llm_calls = sum(result["llm_calls"] for result in results)
+    correct_codes = topography_correct + morphology_correct
+
+    n = len(rows)
+    print(f"\nPipeline: {args.pipeline}   Reports: {n}   Workers: {args.workers}")
+    print(f"Topography accuracy: {topography_correct}/{n} ({topography_correct / n:.1%})")
+    print(f"Morphology accuracy: {morphology_correct}/{n} ({morphology_correct / n:.1%})")
+    print(f"Both codes correct:  {both_correct}/{n} ({both_correct / n:.1%})")
+    if latencies:
+        print(
+            f"Latency per report:  mean {sum(latencies) / len(latencies):.2f} s, "
+            f"p50 {_percentile(latencies, 0.5):.2f} s, p95 {_percentile(latencies, 0.95):.2f} s"
+        )
+    print(f"Wall time:           {wall_time:.2f} s ({n / wall_time:.3f} reports/s)")
+    print(
+        f"LLM calls:           {llm_calls} total, {llm_calls / n:.2f} per report, "
+        + (f"{llm_calls / correct_codes:.2f} per correct code" if correct_codes else "no correct codes")
+    )
+
+    topography_matrix = confusion_matrix(gold_topography, predicted_topography)
+    morphology_matrix = confusion_matrix(gold_morphology, predicted_morphology)
+    _print_per_code("topography", topography_matrix)
+    _print_per_code("morphology", morphology_matrix)
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        write_confusion_csv(os.path.join(args.output_dir, "topography_confusion.csv"), topography_matrix)
+        write_confusion_csv(os.path.join(args.output_dir, "morphology_confusion.csv"), morphology_matrix)
+        with open(os.path.join(args.output_dir, "predictions.csv"), "w", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(["SNOT", "SNOM", "Predicted SNOT", "Predicted SNOM", "Latency (s)", "LLM calls", "Topography answer", "Morphology answer", "Topography codebook", "Morphology codebook"])
+            for row, result in zip(rows, results):
+                writer.writerow([
+                    row["SNOT"], row["SNOM"], result["topography"], result["morphology"],
+                    f"{result['latency']:.2f}" if result["latency"] is not None else "",
+                    result["llm_calls"], result.get("topography_answer", ""), result.get("morphology_answer", ""),
+                    result.get("topography_codebook", ""), result.get("morphology_codebook", ""),
+                ])
+        print(f"\nPredictions and confusion matrices written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import base64
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PRAISE_meta"))
+
+
+@pytest.fixture(scope="session")
+def tiny_checkpoint(tmp_path_factory):
+    """Tiny random Llama checkpoint with a byte-level tokenizer, for exercising the CPU path without real weights."""
+    pytest.importorskip("torch")
+    pytest.importorskip("fairscale")
+    pytest.importorskip("llama")
+    from cpu_generator import save_random_checkpoint
+
+    directory = tmp_path_factory.mktemp("tiny_llama")
+    # A tiktoken BPE file with only the 256 single-byte tokens and no merges
+    tokenizer_path = directory / "tokenizer.model"
+    tokenizer_path.write_text("".join(f"{base64.b64encode(bytes([i])).decode()} {i}\n" for i in range(256)))
+    ckpt_dir = directory / "checkpoint"
+    save_random_checkpoint(str(ckpt_dir), str(tokenizer_path))
+    return str(ckpt_dir), str(tokenizer_path)
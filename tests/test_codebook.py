@@ -0,0 +1,63 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PRAISE_meta"))
+from codebook import (
+    MORPHOLOGY_CODEBOOK,
+    MORPHOLOGY_FALLBACK,
+    TOPOGRAPHY_CODEBOOK,
+    TOPOGRAPHY_FALLBACK,
+    build_morphology_prompt,
+    build_topography_prompt,
+    distance_to_topography,
+    rank_codebook,
+)
+
+SUMMARY = "The tumor is located at the hepatic flexure. Invasive adenocarcinoma, moderately differentiated."
+
+
+def _ranked_codes(query, codebook):
+    return [code for _, code in rank_codebook(query, codebook)]
+
+
+def test_tumor_does_not_pull_in_carcinoid():
+    _, codes = build_morphology_prompt("{codebook}", SUMMARY)
+    assert "M82401" not in codes
+    assert "M82403" not in codes
+    assert "M82401" not in _ranked_codes(SUMMARY, MORPHOLOGY_CODEBOOK)
+
+
+def test_carcinoid_ranked_when_mentioned():
+    assert _ranked_codes("Malignant carcinoid tumour of the appendix", MORPHOLOGY_CODEBOOK)[0] == "M82403"
+
+
+def test_adenocarcinoma_nos_ranks_above_primary_or_secondary():
+    ranked = _ranked_codes(SUMMARY, MORPHOLOGY_CODEBOOK)
+    assert ranked[0] == "M81403"
+    assert ranked.index("M81403") < ranked.index("M81409")
+
+
+def test_distance_maps_to_site():
+    assert distance_to_topography("Mass at 80 cm from the anal verge") == ["Descending Colon"]
+    _, codes = build_topography_prompt("{codebook}", "Mass at 80 cm from the anal verge")
+    assert "67600" in codes
+
+
+def test_site_ranked_first():
+    assert _ranked_codes("Polyp in the sigmoid colon", TOPOGRAPHY_CODEBOOK)[0] == "67700"
+    assert _ranked_codes("Rectal adenocarcinoma", TOPOGRAPHY_CODEBOOK)[0] == "68000"
+
+
+def test_fallback_codes_always_included():
+    _, topography_codes = build_topography_prompt("{codebook}", "Unremarkable specimen")
+    _, morphology_codes = build_morphology_prompt("{codebook}", "Unremarkable specimen")
+    assert set(TOPOGRAPHY_FALLBACK) <= set(topography_codes)
+    assert set(MORPHOLOGY_FALLBACK) <= set(morphology_codes)
+
+
+def test_full_codebook_without_top_n():
+    prompt, codes = build_morphology_prompt("Codes:\n{codebook}", SUMMARY, top_n=None)
+    assert codes == [code for code, _ in MORPHOLOGY_CODEBOOK]
+    assert "{codebook}" not in prompt
+    _, codes = build_topography_prompt("{codebook}", SUMMARY, top_n=None)
+    assert codes == [code for code, _ in TOPOGRAPHY_CODEBOOK]
@@ -0,0 +1,38 @@
+import pytest
+
+DIALOG = [{"role": "user", "content": "Sigmoid colon, biopsy: invasive adenocarcinoma."}]
+
+
+@pytest.mark.parametrize("quantize", [True, False])
+def test_chat_completion_on_cpu(tiny_checkpoint, quantize):
+    from cpu_generator import CPULlama, report_memory_footprint
+
+    ckpt_dir, tokenizer_path = tiny_checkpoint
+    generator = CPULlama.build(ckpt_dir, tokenizer_path, max_seq_len=128, max_batch_size=1, quantize=quantize, num_threads=1)
+    result = generator.chat_completion([DIALOG], temperature=0, max_gen_len=4)
+    assert isinstance(result[0]["generation"]["content"], str)
+
+    footprint = report_memory_footprint(generator)
+    assert set(footprint) == {"weights", "kv_cache", "peak_rss"}
+    assert all(value > 0 for value in footprint.values())
+
+
+def test_quantized_weights_are_smaller(tiny_checkpoint):
+    from cpu_generator import CPULlama, report_memory_footprint
+
+    ckpt_dir, tokenizer_path = tiny_checkpoint
+    footprints = {
+        quantize: report_memory_footprint(CPULlama.build(ckpt_dir, tokenizer_path, 128, 1, quantize=quantize, num_threads=1))
+        for quantize in (True, False)
+    }
+    assert footprints[True]["weights"] < footprints[False]["weights"]
+    assert footprints[True]["kv_cache"] == footprints[False]["kv_cache"]
+
+
+def test_logprobs_not_supported(tiny_checkpoint):
+    from cpu_generator import CPULlama
+
+    ckpt_dir, tokenizer_path = tiny_checkpoint
+    generator = CPULlama.build(ckpt_dir, tokenizer_path, max_seq_len=128, max_batch_size=1, num_threads=1)
+    with pytest.raises(NotImplementedError):
+        generator.chat_completion([DIALOG], max_gen_len=4, logprobs=True)
@@ -0,0 +1,54 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "evaluation"))
+from evaluate import (
+    Pipeline,
+    evaluate_report,
+    normalize_morphology,
+    normalize_topography,
+    parse_morphology_code,
+    parse_topography_code,
+)
+
+
+def test_topography_code_after_anchor():
+    answer = "The topography is Sigmoid colon and its SNOMED code is 67700 (not 67000)."
+    assert parse_topography_code(answer) == "67700"
+    assert parse_topography_code("The Topography is Rectum and its SNOMED Code is **T-68000**") == "68000"
+
+
+def test_topography_first_codebook_code_without_anchor():
+    assert parse_topography_code("Candidates 99999, 67600 and 67700") == "67600"
+    assert parse_topography_code("No code given") is None
+
+
+def test_morphology_code_after_anchor():
+    answer = "The morphology is Adenocarcinoma, NOS and its SNOMED code is M81403. Also considered M80103."
+    assert parse_morphology_code(answer) == "M81403"
+    assert parse_morphology_code('its SNOMED Code is "81403"') == "M81403"
+
+
+def test_morphology_first_codebook_code_without_anchor():
+    assert parse_morphology_code("M81400 or M81403") == "M81400"
+
+
+class _FailingLLM:
+    def call(self, prompt):
+        raise RuntimeError("model unavailable")
+
+
+def test_failing_report_counts_as_uncoded():
+    llm = _FailingLLM()
+    pipeline = Pipeline(lambda report: llm.call(report), llm, "call")
+    result = evaluate_report(pipeline, "report")
+    assert result["topography"] is None
+    assert result["morphology"] is None
+    assert result["llm_calls"] == 1
+
+
+def test_gold_labels_take_the_first_code():
+    assert normalize_topography("#T-67600") == "67600"
+    assert normalize_topography("#T-67600 / #T-68000") == "67600"
+    assert normalize_topography("") is None
+    assert normalize_morphology("M-81403") == "M81403"
@@ -0,0 +1,42 @@
+import pytest
+
+pytest.importorskip("fire")
+pytest.importorskip("llama")
+from SNOMED_coding_meta import assign_mcode, assign_snomed, code_report
+
+
+class _StubTokenizer:
+    def encode(self, text, bos, eos):
+        return text.split()
+
+
+class _StubGenerator:
+    """Counts one token per word and answers every prompt with a fixed (long) summary."""
+
+    tokenizer = _StubTokenizer()
+
+    def __init__(self, answer):
+        self.answer = answer
+
+    def chat_completion(self, dialogs, max_gen_len, temperature, top_p):
+        return [{"generation": {"role": "assistant", "content": self.answer}}]
+
+
+def test_overflow_returns_empty_answer_with_codes():
+    generator = _StubGenerator("unused")
+    summary = "Adenocarcinoma of the sigmoid colon. " * 500
+    answer, codes = assign_snomed(generator, summary, None, 0, 0.9, max_seq_len=100)
+    assert answer == ""
+    assert "67700" in codes
+    answer, codes = assign_mcode(generator, summary, None, 0, 0.9, max_seq_len=100)
+    assert answer == ""
+    assert "M81403" in codes
+
+
+def test_code_report_survives_overflowing_summary():
+    # The summary prompt fits, but the coding prompts that embed the long summary do not
+    generator = _StubGenerator("Adenocarcinoma of the sigmoid colon. " * 500)
+    result = code_report(generator, "Sigmoid colon, biopsy: adenocarcinoma.", None, 0, 0.9, max_seq_len=1000)
+    assert result["Topography"] == ""
+    assert result["Morphology"] == ""
+    assert "67700" in result["Topography codebook"].split()
@@ -0,0 +1,63 @@
+import os
+import subprocess
+import sys
+import textwrap
+import time
+
+from worker_pool import run_worker_pool
+
+PRAISE_META_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "PRAISE_meta")
+
+
+def _square(generator, item):
+    # Later items finish first, so the results arrive out of order
+    time.sleep(0.01 * (5 - item % 5))
+    return generator * item * item
+
+
+def _fail_on_three(generator, item):
+    if item == 3:
+        raise ValueError("bad report")
+    return item
+
+
+def _exit_on_zero(generator, item):
+    if item == 0:
+        os._exit(1)
+    return item
+
+
+def test_results_in_input_order():
+    assert run_worker_pool(1, _square, list(range(12)), 3) == [item * item for item in range(12)]
+
+
+def test_failing_item_is_none():
+    assert run_worker_pool(None, _fail_on_three, list(range(6)), 2) == [0, 1, 2, None, 4, 5]
+
+
+def test_results_kept_when_a_worker_exits():
+    # The first item kills whichever worker takes it, before that worker has produced anything
+    assert run_worker_pool(None, _exit_on_zero, list(range(6)), 2) == [None, 1, 2, 3, 4, 5]
+
+
+def test_forked_workers_do_not_hang_after_loading(tiny_checkpoint):
+    ckpt_dir, tokenizer_path = tiny_checkpoint
+    # Run in a separate process so that a hang in the OpenMP runtime fails the test instead of blocking it
+    script = textwrap.dedent(f"""
+        import sys
+        sys.path.insert(0, {PRAISE_META_DIR!r})
+        from cpu_generator import CPULlama
+        from worker_pool import run_worker_pool
+
+        def complete(generator, text):
+            return generator.chat_completion([[{{"role": "user", "content": text}}]], temperature=0, max_gen_len=4)
+
+        # The coordinator runs multi-threaded ops before forking, as a real batch run does
+        generator = CPULlama.build({ckpt_dir!r}, {tokenizer_path!r}, max_seq_len=128, max_batch_size=1, num_threads=4)
+        complete(generator, "warm up")
+        results = run_worker_pool(generator, complete, ["colon", "rectum", "cecum", "sigmoid"], 2)
+        print(sum(result is not None for result in results))
+    """)
+    completed = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, timeout=300)
+    assert completed.returncode == 0, completed.stderr
+    assert completed.stdout.split()[-1] == "4"